@@ -1,13 +1,20 @@
 from typing import Sequence  # noqa
 
+try:
+    from functools import lru_cache
+except ImportError:  # pragma: no cover
+    from backports.functools_lru_cache import lru_cache  # type: ignore
+
 from .derivative import RegularExpression  # noqa
-from .derivative import RegexVisitor
 from .dfa import DEFAULT_ALPHABET
 from .dfa import DFA, String  # noqa
 from .generation import DeterministicRegularLanguageGenerator, RandomRegularLanguageGenerator  # noqa
+from .regex_grammar import Parser
+
 
+@lru_cache(maxsize=1024)
 def compile(regex):  # type: (String) -> RegularExpression
-    return RegexVisitor().parse(regex)
+    return Parser(regex).parse()
 
 
 def build_dfa(regex, alphabet=DEFAULT_ALPHABET):
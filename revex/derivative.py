@@ -9,26 +9,35 @@ See also https://en.wikipedia.org/wiki/Brzozowski_derivative
 """
 from __future__ import unicode_literals
 
-import operator
 import re
 import string
-from ast import literal_eval
-from functools import reduce, total_ordering
+from collections import OrderedDict, deque
+from functools import total_ordering, wraps
+from itertools import count
+from operator import attrgetter
+from typing import Callable  # noqa
+from typing import Dict  # noqa
+from typing import FrozenSet  # noqa
+from typing import Iterable  # noqa
+from typing import List  # noqa
 from typing import Optional  # noqa
 from typing import Set  # noqa
 from typing import Sequence  # noqa
 from typing import Tuple  # noqa
+from weakref import WeakValueDictionary
 
 import six
-from six import unichr as chr
-
-from parsimonious import NodeVisitor
 
 from revex.dfa import String, DFA  # noqa
-from revex.regex_grammar import REGEX
 from .dfa import DEFAULT_ALPHABET
 
 
+_interned = WeakValueDictionary()  # type: WeakValueDictionary[tuple, RegularExpression]
+
+# Source of unique ids for interned regexes.
+_uids = count()
+
+
 @total_ordering
 class RegularExpression(object):
     """
@@ -42,6 +51,16 @@ class RegularExpression(object):
         - Concatenation:   R1 + R2
         - Star:            Star(R)
     """
+    # There are a lot of regexes, so they use slots rather than a __dict__.
+    # identity_tuple uniquely identifies the regex, and is computed by each
+    # constructor. It's used as the key for interning instances (which needs
+    # __weakref__). The other slots are set when a regex is interned, or cache
+    # values computed on first use.
+    __slots__ = (
+        'identity_tuple', '_uid', '_derivatives', '_distinguished_sets', '_first_chars',
+        '_required_literal', '_complement', '_cached_str', '_cached_repr', '__weakref__',
+    )
+
     is_atomic = True
 
     def as_dfa(self, alphabet=DEFAULT_ALPHABET):
@@ -57,83 +76,265 @@ class RegularExpression(object):
             start_accepting=self.accepting,
             alphabet=alphabet,
         )
-        nodes = {self}  # type: Set[RegularExpression]
-        while nodes:
-            node = nodes.pop()
-            for char in alphabet:
-                derivative = node.derivative(char)
-                if not dfa.has_node(derivative):
-                    nodes.add(derivative)
+        # Explore breadth first, so states are added in a deterministic order.
+        # Regexes are interned, so checking the seen set is just a lookup by
+        # the cached hash and identity.
+        seen = {self}  # type: Set[RegularExpression]
+        worklist = deque([self])
+        while worklist:
+            node = worklist.popleft()
+            # Only take one derivative for each block of chars which are known
+            # to have the same derivative.
+            for chars in node.derivative_partition(alphabet):
+                derivative = node.derivative(chars[0])
+                if derivative not in seen:
+                    seen.add(derivative)
+                    worklist.append(derivative)
                     dfa.add_state(derivative, derivative.accepting)
-                dfa.add_transition(node, derivative, char)
+                node._derivatives.update(dict.fromkeys(chars, derivative))
+                dfa.add_transitions(node, derivative, chars)
         return dfa
 
     def __add__(self, other):
         return Concatenation(self, other)
 
     def __and__(self, other):
+        if other is self:
+            # Regexes are interned, so this catches all cases of R & R == R.
+            return self
         return Intersection(self, other)
 
     def __or__(self, other):
+        if other is self:
+            return self
         return Union(self, other)
 
     def __invert__(self):
-        return Complement(self)
+        # Complements are taken over and over when deriving negative
+        # lookarounds, so cache them on the regex.
+        try:
+            return self._complement
+        except AttributeError:
+            complement = self._complement = Complement(self)
+            if isinstance(complement, Complement):
+                # Then ~~R is R, so cache that too.
+                complement._complement = self
+            return complement
 
     def __mul__(self, repeat):  # type: (int) -> RegularExpression
-        return EPSILON if repeat == 0 else reduce(operator.add, [self] * repeat)
+        # Build the repetition by doubling, so only O(log(repeat)) intermediate
+        # concatenations get constructed (each of which copies its children).
+        if repeat == 0:
+            return EPSILON
+        elif repeat == 1:
+            return self
+        half = self * (repeat // 2)
+        doubled = half + half
+        return doubled + self if repeat % 2 else doubled
 
     __rmul__ = __mul__
 
+    # Whether an end-string is accepted with this regex. Set by each subclass,
+    # either as a class attribute or on construction.
+    accepting = None  # type: bool
+
+    # Whether or not this regex has a lookahead/lookbehind assertion. Composite
+    # regexes compute these from their children on construction.
+    has_lookahead = False
+    has_lookbehind = False
+
+    def derivative(self, char):  # type: (String) -> RegularExpression
+        try:
+            return self._derivatives[char]
+        except KeyError:
+            first_chars = self.first_chars
+            if first_chars is not None and char not in first_chars:
+                # No need to look into the regex at all.
+                derivative = EMPTY
+            else:
+                derivative = self._derivative(char)
+            self._derivatives[char] = derivative
+            return derivative
+
+    def _derivative(self, char):  # type: (String) -> RegularExpression
+        raise NotImplementedError
+
     @property
-    def accepting(self):  # type: () -> bool
+    def distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
         """
-        Whether an end-string is accepted with this regex.
+        Sets of chars such that any two chars which belong to exactly the same
+        sets have the same derivative. Computed on first use, except for
+        charsets.
         """
+        try:
+            return self._distinguished_sets
+        except AttributeError:
+            distinguished_sets = self._distinguished_sets = self._compute_distinguished_sets()
+            return distinguished_sets
+
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
         raise NotImplementedError
 
     @property
-    def has_lookahead(self):  # type: () -> bool
+    def first_chars(self):  # type: () -> Optional[FrozenSet[String]]
         """
-        Whether or not this regex has a lookahead assertion.
+        The chars which can begin a string matched by this regex, or None if
+        they aren't bounded (e.g. for [^a] or ~R). The derivative with respect
+        to any other char is EMPTY. Computed on first use.
         """
-        return False
+        try:
+            return self._first_chars
+        except AttributeError:
+            first_chars = self._first_chars = self._compute_first_chars()
+            return first_chars
+
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        raise NotImplementedError
 
     @property
-    def has_lookbehind(self):  # type: () -> bool
+    def required_literal(self):  # type: () -> String
         """
-        Whether or not this regex has a lookbehind assertion.
+        A string which occurs in every string matched by this regex, e.g. "foo"
+        for .*foo(bar|baz). Possibly empty. Computed on first use.
         """
-        return False
+        try:
+            return self._required_literal
+        except AttributeError:
+            required_literal = self._required_literal = self._compute_required_literal()
+            return required_literal
 
-    def derivative(self, char):  # type: (String) -> RegularExpression
-        raise NotImplementedError
+    def _compute_required_literal(self):  # type: () -> String
+        return ''
+
+    def _exact_literal(self):  # type: () -> Optional[String]
+        """
+        The only string matched by this regex, or None if it matches something
+        other than exactly one string.
+        """
+        return None
+
+    def derivative_partition(self, alphabet):
+        # type: (Sequence[String]) -> List[List[String]]
+        """
+        Partitions the alphabet into blocks of chars which have the same
+        derivative, ordered by their first char.
+
+        This is the "derivative classes" construction from Owens, Reppy and
+        Turon, "Regular-expression derivatives re-examined", which lets DFA
+        construction take one derivative per block rather than per char.
+        """
+        sets = list(self.distinguished_sets)
+        if not sets:
+            # E.g. for ., .* or ε, every char has the same derivative.
+            return [list(alphabet)] if alphabet else []
+        # Chars not mentioned by any of the sets all have the same derivative,
+        # so don't bother testing them against each set.
+        used_chars = frozenset().union(*sets)
+        unused = ()  # type: Tuple[bool, ...]
+        blocks = OrderedDict()  # type: OrderedDict[Tuple[bool, ...], List[String]]
+        for char in alphabet:
+            key = tuple(char in chars for chars in sets) if char in used_chars else unused
+            blocks.setdefault(key, []).append(char)
+        return list(blocks.values())
 
     def match(self, string):  # type: (String) -> bool
+        """
+        Matching lazily constructs the DFA of this regex: regexes are interned,
+        so they are the states, and their memoized derivatives are the
+        transitions. Once a transition has been seen, following it is just a
+        dict lookup.
+
+        EMPTY is a dead state, so stop as soon as it's reached. Strings which
+        don't contain the regex's required literal are rejected up front.
+        """
+        required_literal = self.required_literal
+        if required_literal and required_literal not in string:
+            return False
         regex = self
-        for i in range(len(string)):
-            regex = regex.derivative(string[i:i+1])
+        for char in string:
+            try:
+                regex = regex._derivatives[char]
+            except KeyError:
+                regex = regex.derivative(char)
+            if regex is EMPTY:
+                return False
         return regex.accepting
 
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, )
+    def _intern(self):  # type: () -> RegularExpression
+        """
+        Returns the canonical instance of this regex, i.e. the first live
+        instance constructed with the same identity_tuple.
+
+        Every constructor returns an interned instance, so structurally equal
+        regexes are the same object. This makes equality checks a pointer
+        comparison, and lets the memoized derivatives be shared between all
+        the places a regex occurs.
+        """
+        key = self.identity_tuple
+        instance = _interned.get(key)
+        if instance is None:
+            # Only set up state on instances which are actually kept; the
+            # others are discarded immediately. Interned regexes are unique, so
+            # an integer id serves as the hash.
+            self._uid = next(_uids)
+            # Memoized derivatives, keyed by character. Derivatives are
+            # computed over and over again when matching or building a DFA,
+            # and are pure functions of the regex.
+            self._derivatives = {}  # type: Dict[String, RegularExpression]
+            instance = _interned[key] = self
+        return instance
 
     def __hash__(self):
-        if not hasattr(self, '_hash'):
-            self._hash = hash(self.identity_tuple)
-        return self._hash
+        return self._uid
 
     def __eq__(self, other):
-        return type(self) == type(other) and self.identity_tuple == other.identity_tuple
+        return self is other
 
     def __ne__(self, other):
-        return not (self == other)
+        return self is not other
 
     def __lt__(self, other):
         if not isinstance(other, RegularExpression):  # pragma: no cover
             raise TypeError(type(other))
-        return self.identity_tuple < other.identity_tuple
+        # Any fixed order will do for canonicalizing unions and intersections,
+        # and comparing ids doesn't need to walk the regexes.
+        return self._uid < other._uid
+
+
+def _union_first_chars(regexes):
+    # type: (Iterable[RegularExpression]) -> Optional[FrozenSet[String]]
+    first_chars = frozenset()  # type: FrozenSet[String]
+    for regex in regexes:
+        if regex.first_chars is None:
+            return None
+        first_chars |= regex.first_chars
+    return first_chars
+
+
+def _intersect_first_chars(regexes):
+    # type: (Iterable[RegularExpression]) -> Optional[FrozenSet[String]]
+    bounded = [regex.first_chars for regex in regexes if regex.first_chars is not None]
+    return frozenset.intersection(*bounded) if bounded else None
+
+
+def _memoize_string(method):
+    # type: (Callable[[RegularExpression], String]) -> Callable[[RegularExpression], String]
+    """
+    Caches the result of __str__ or __repr__ on the regex. Regexes are
+    immutable, and composite regexes would otherwise rebuild the string from
+    their whole subtree on every call.
+    """
+    attribute = '_cached_%s' % method.__name__.strip('_')
+
+    @wraps(method)
+    def wrapper(self):  # type: (RegularExpression) -> String
+        string = getattr(self, attribute, None)
+        if string is None:
+            string = method(self)
+            setattr(self, attribute, string)
+        return string
+
+    return wrapper
 
 
 def parenthesize_str(regex):
@@ -146,17 +347,27 @@ def parenthesize_repr(regex):
 
 @six.python_2_unicode_compatible
 class _Empty(RegularExpression):
+    __slots__ = ()
+
     def __new__(cls):
         try:
             return EMPTY
         except NameError:
-            return super(_Empty, cls).__new__(cls)
+            instance = super(_Empty, cls).__new__(cls)
+            instance.identity_tuple = (cls, )
+            return instance._intern()
 
     accepting = False
 
-    def derivative(self, char):  # type: (String) -> RegularExpression
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return frozenset()
+
+    def _derivative(self, char):  # type: (String) -> RegularExpression
         return EMPTY
 
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return frozenset()
+
     def __str__(self):
         return '∅'
 
@@ -169,17 +380,30 @@ EMPTY = _Empty()
 
 @six.python_2_unicode_compatible
 class _Epsilon(RegularExpression):
+    __slots__ = ()
+
     def __new__(cls):
         try:
             return EPSILON
         except NameError:
-            return super(_Epsilon, cls).__new__(cls)
+            instance = super(_Epsilon, cls).__new__(cls)
+            instance.identity_tuple = (cls, )
+            return instance._intern()
 
     accepting = True
 
-    def derivative(self, char):  # type: (String) -> RegularExpression
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return frozenset()
+
+    def _derivative(self, char):  # type: (String) -> RegularExpression
         return EMPTY
 
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return frozenset()
+
+    def _exact_literal(self):  # type: () -> Optional[String]
+        return ''
+
     def __str__(self):
         return 'ε'
 
@@ -195,17 +419,27 @@ class _Dot(RegularExpression):
     """
     Special expression for matching any character.
     """
+    __slots__ = ()
+
     def __new__(cls):
         try:
             return DOT
         except NameError:
-            return super(_Dot, cls).__new__(cls)
+            instance = super(_Dot, cls).__new__(cls)
+            instance.identity_tuple = (cls, )
+            return instance._intern()
 
     accepting = False
 
-    def derivative(self, char):  # type: (String) -> RegularExpression
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return frozenset()
+
+    def _derivative(self, char):  # type: (String) -> RegularExpression
         return EPSILON
 
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return None
+
     def __str__(self):
         return '.'
 
@@ -218,20 +452,21 @@ DOT = _Dot()
 
 @six.python_2_unicode_compatible
 class Concatenation(RegularExpression):
-    children = None  # type: Tuple[RegularExpression, ...]
+    __slots__ = ('children', 'accepting', 'has_lookahead', 'has_lookbehind', '_tail')
 
     def __new__(cls, *children):  # type: (*RegularExpression) -> RegularExpression
-        flattened_children = []
+        # Flatten nested concatenations and drop EPSILONs in a single pass. The
+        # children of a Concatenation are already normalized, so they can be
+        # copied over wholesale.
+        flattened_children = []  # type: List[RegularExpression]
         for child in children:
             if isinstance(child, Concatenation):
-                for subchild in child.children:
-                    flattened_children.append(subchild)
-            else:
+                flattened_children.extend(child.children)
+            elif child is EMPTY:
+                return EMPTY
+            elif child is not EPSILON:
                 flattened_children.append(child)
         children = tuple(flattened_children)
-        if EMPTY in children:
-            return EMPTY
-        children = tuple(child for child in children if child is not EPSILON)
         children = LookBehind.collapse_concatenation(children)
         children = LookAhead.collapse_concatenation(children)
 
@@ -240,25 +475,29 @@ class Concatenation(RegularExpression):
         elif len(children) == 1:
             return children[0]
         else:
-            instance = super(Concatenation, cls).__new__(cls)
+            return cls._from_normalized_children(children)
+
+    @classmethod
+    def _from_normalized_children(cls, children):
+        # type: (Tuple[RegularExpression, ...]) -> RegularExpression
+        """
+        Builds the concatenation of two or more children, which must already
+        be flattened, free of EMPTY and EPSILON, and have no lookarounds left
+        to collapse.
+        """
+        instance = super(Concatenation, cls).__new__(cls)
+        instance.identity_tuple = (cls, children)
+        interned = instance._intern()
+        if interned is instance:
             instance.children = children
-            return instance
+            instance.accepting = all(child.accepting for child in children)
+            instance.has_lookahead = children[-1].has_lookahead
+            instance.has_lookbehind = children[0].has_lookbehind
+        return interned
 
     is_atomic = False
 
-    @property
-    def has_lookahead(self):  # type: () -> bool
-        return self.children[-1].has_lookahead
-
-    @property
-    def has_lookbehind(self):  # type: () -> bool
-        return self.children[0].has_lookbehind
-
-    @property
-    def accepting(self):
-        return all(child.accepting for child in self.children)
-
-    def derivative(self, char):
+    def _derivative(self, char):
         """
         Build up a disjunction of derivatives, starting from the left, stopping
         when we hit a non-accepting regex.
@@ -274,34 +513,101 @@ class Concatenation(RegularExpression):
         * The third is where the first two children matched with ε, then the third
           child consumed the character. At this point, we can go no further, since
           the "a" _must_ have been consumed by the third child.
+
+        All but the first disjunct make up the derivative of the tail [ab]?[abc]ad,
+        which is memoized on the tail, so compute it from that.
+
+        Rather than recursing into the tail's derivative (which would exceed
+        the recursion limit on long runs like a?a?a?...), first collect the
+        chain of tails whose derivatives are needed, then compute them from
+        the end of the chain back, memoizing each on the way.
         """
-        derivative = EMPTY
-        for i, child in enumerate(self.children):
-            derivative = derivative | (child.derivative(char) + Concatenation(*self.children[i+1:]))
-            if not child.accepting:
+        chain = [self]
+        while chain[-1].children[0].accepting:
+            tail = chain[-1].tail
+            if not isinstance(tail, Concatenation) or char in tail._derivatives:
                 break
+            chain.append(tail)
+        for concatenation in reversed(chain):
+            head, tail = concatenation.children[0], concatenation.tail
+            derivative = head.derivative(char) + tail
+            if head.accepting:
+                derivative = derivative | tail.derivative(char)
+            concatenation._derivatives[char] = derivative
         return derivative
 
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        # As with first_chars, only the children up to the first one which
+        # doesn't match the empty string can consume the first char. Loop over
+        # them rather than recursing into the tail, so long concatenations
+        # don't exceed the recursion limit.
+        distinguished_sets = []  # type: List[FrozenSet[FrozenSet[String]]]
+        for child in self.children:
+            distinguished_sets.append(child.distinguished_sets)
+            if not child.accepting:
+                break
+        return frozenset().union(*distinguished_sets)
+
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        # The first char can be consumed by any child up to the first one
+        # which doesn't match the empty string.
+        prefix = []  # type: List[RegularExpression]
+        for child in self.children:
+            prefix.append(child)
+            if not child.accepting:
+                break
+        return _union_first_chars(prefix)
+
+    def _compute_required_literal(self):  # type: () -> String
+        # Consecutive literal children must occur together, so join them up.
+        candidates = []  # type: List[String]
+        run = []  # type: List[String]
+        for child in self.children:
+            literal = child._exact_literal()
+            if literal is None:
+                candidates.append(''.join(run))
+                candidates.append(child.required_literal)
+                run = []
+            else:
+                run.append(literal)
+        candidates.append(''.join(run))
+        return max(candidates, key=len)
+
+    def _exact_literal(self):  # type: () -> Optional[String]
+        literals = [child._exact_literal() for child in self.children]
+        return None if None in literals else ''.join(literals)
+
     @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.children)
+    def tail(self):  # type: () -> RegularExpression
+        """
+        The concatenation of all but the first child, built on first use.
+        """
+        try:
+            return self._tail
+        except AttributeError:
+            tail = self._tail = Concatenation(*self.children[1:])
+            return tail
 
+    @_memoize_string
     def __str__(self):
         return ''.join(map(parenthesize_str, self.children))
 
+    @_memoize_string
     def __repr__(self):
         return '+'.join(map(parenthesize_repr, self.children))
 
 
 @six.python_2_unicode_compatible
 class Intersection(RegularExpression):
-    children = None  # type: Tuple[RegularExpression, ...]
+    __slots__ = ('children', 'accepting', 'has_lookahead', 'has_lookbehind')
 
     def __new__(cls, *children_tuple):  # type: (*RegularExpression) -> RegularExpression
+        if len(children_tuple) == 1:
+            return children_tuple[0]
         children = set()  # type: Set[RegularExpression]
         for child in children_tuple:
             if isinstance(child, Intersection):
-                children |= set(child.children)
+                children.update(child.children)
             else:
                 children.add(child)
         if EMPTY in children:
@@ -311,137 +617,169 @@ class Intersection(RegularExpression):
                 return EPSILON
             else:
                 return EMPTY
+        elif any(isinstance(child, Complement) and child.regex in children
+                 for child in children):
+            # R & ~R is empty.
+            return EMPTY
 
-        # Normalize all the charsets and negated charsets into (at most) two.
-        charsets = {c for c in children if isinstance(c, CharSet) and not c.negated}
-        negated_charsets = {c for c in children if isinstance(c, CharSet) and c.negated}
-        children  = (children - charsets) - negated_charsets
-        if charsets:
-            charset = CharSet(reduce(operator.and_, (set(c.chars) for c in charsets)))  # type: Optional[CharSet]
-        else:
-            charset = None
-        if negated_charsets:
-            negated_charset = CharSet(
-                reduce(operator.or_, (set(c.chars) for c in negated_charsets)),
-                negated=True)  # type: Optional[CharSet]
-        else:
-            negated_charset = None
-
-        if charset and negated_charset:
-            # If we have a charset and a negated charset, then compute their
-            # difference.
-            chars = set(charset.chars) - set(negated_charset.chars)  # type: Set[String]
-            if not chars:  # The intersection is empty, so simplify to that.
-                return EMPTY
+        # Normalize all the charsets and negated charsets into (at most) one,
+        # partitioning them out of the children in a single pass.
+        chars = None  # type: Optional[FrozenSet[String]]
+        negated_chars = None  # type: Optional[FrozenSet[String]]
+        others = set()  # type: Set[RegularExpression]
+        for child in children:
+            if not isinstance(child, CharSet):
+                others.add(child)
+            elif child.negated:
+                negated_chars = child.chars if negated_chars is None else negated_chars | child.chars
             else:
-                charset = CharSet(chars)
-                negated_charset = None
-
-        if charset:
+                chars = child.chars if chars is None else chars & child.chars
+        children = others
+
+        if chars is not None:
+            if negated_chars is not None:
+                # If we have a charset and a negated charset, then compute their
+                # difference.
+                chars = chars - negated_chars
             # Now restrict chars down to those which all the other conjuncts can
             # accept. These are exactly the chars recognized by this regex, so
             # just return the charset.
-            acceptable_chars = {
-                char for char in charset.chars
-                if all(child.derivative(char).accepting for child in children)
-            }  # type: Set[String]
+            # Derivatives are memoized, so this work is shared with any later
+            # derivative computations on the children.
+            acceptable_chars = chars  # type: Iterable[String]
+            for child in children:
+                if not acceptable_chars:
+                    break
+                acceptable_chars = [
+                    char for char in acceptable_chars
+                    if child.derivative(char).accepting]
             if not acceptable_chars:
                 return EMPTY
             else:
                 return CharSet(acceptable_chars)
-        elif negated_charset:
-            children.add(charset or negated_charset)
+        elif negated_chars is not None:
+            children.add(CharSet(negated_chars, negated=True))
 
         if len(children) == 1:
             return children.pop()
         else:
+            # Intersection is commutative, so it is identified by the set of
+            # its children. Only sort them into canonical order if this
+            # intersection has not been constructed before.
             instance = super(Intersection, cls).__new__(cls)
-            instance.children = tuple(sorted(children))
-            return instance
+            instance.identity_tuple = (cls, frozenset(children))
+            interned = instance._intern()
+            if interned is instance:
+                instance.children = tuple(sorted(children, key=attrgetter('_uid')))
+                instance.accepting = all(child.accepting for child in children)
+                instance.has_lookahead = any(child.has_lookahead for child in children)
+                instance.has_lookbehind = any(child.has_lookbehind for child in children)
+            return interned
 
     is_atomic = False
 
-    @property
-    def has_lookahead(self):  # type: () -> bool
-        return any(child.has_lookahead for child in self.children)
+    def _derivative(self, char):  # type: (String) -> RegularExpression
+        return Intersection(*[child.derivative(char) for child in self.children])
 
-    @property
-    def has_lookbehind(self):  # type: () -> bool
-        return any(child.has_lookbehind for child in self.children)
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return frozenset().union(*(child.distinguished_sets for child in self.children))
 
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.children)
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return _intersect_first_chars(self.children)
 
-    @property
-    def accepting(self):
-        return all(child.accepting for child in self.children)
-
-    def derivative(self, char):  # type: (String) -> RegularExpression
-        return reduce(operator.and_, (child.derivative(char) for child in self.children))
+    def _compute_required_literal(self):  # type: () -> String
+        return max((child.required_literal for child in self.children), key=len)
 
+    # Children are ordered by creation, which varies between processes, so
+    # render them in sorted order to keep strings stable.
+    @_memoize_string
     def __str__(self):
-        return '∩'.join(map(parenthesize_str, self.children))
+        return '∩'.join(sorted(map(parenthesize_str, self.children)))
 
+    @_memoize_string
     def __repr__(self):
-        return '&'.join(map(parenthesize_repr, self.children))
+        return '&'.join(sorted(map(parenthesize_repr, self.children)))
 
 
 @six.python_2_unicode_compatible
 class CharSet(RegularExpression):
-    negated = None  # type: bool
-    chars = None  # type: tuple
+    __slots__ = ('negated', 'chars', '_sorted_chars')
 
     def __new__(cls, chars, negated=False):
         instance = super(CharSet, cls).__new__(cls)
-        instance.chars = tuple(sorted(chars))
-        instance.negated = negated
-        return instance
+        chars = frozenset(chars)
+        instance.identity_tuple = (cls, negated, chars)
+        interned = instance._intern()
+        if interned is instance:
+            instance.chars = chars
+            instance.negated = negated
+            # The sorted chars are only needed for display, so only sort
+            # them for new instances.
+            instance._sorted_chars = tuple(sorted(chars))
+            # Seed the derivative table with the chars in the set, so deriving
+            # by any of them is a single dict lookup.
+            instance._derivatives = dict.fromkeys(chars, EMPTY if negated else EPSILON)
+            instance._distinguished_sets = frozenset([chars])
+        return interned
 
     accepting = False
     is_atomic = True
 
-    def derivative(self, char):  # type: (String) -> RegularExpression
+    def _derivative(self, char):  # type: (String) -> RegularExpression
         if self.negated:
             return EMPTY if char in self.chars else EPSILON
         else:
             return EPSILON if char in self.chars else EMPTY
 
-    @property
-    def identity_tuple(self):
-        return (CharSet.__name__, self.negated, self.chars)
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return None if self.negated else self.chars
+
+    def _compute_required_literal(self):  # type: () -> String
+        return self._exact_literal() or ''
+
+    def _exact_literal(self):  # type: () -> Optional[String]
+        if len(self.chars) == 1 and not self.negated:
+            return self._sorted_chars[0]
+        return None
 
     def __str__(self):
         if len(self.chars) == 1 and not self.negated:
-            return six.text_type(self.chars[0])
-        return '[%s%s]' % ('^' if self.negated else '', ''.join(self.chars))
+            return six.text_type(self._sorted_chars[0])
+        return '[%s%s]' % ('^' if self.negated else '', ''.join(self._sorted_chars))
 
     def __repr__(self):
-        return 'CharSet(%r, negated=%r)' % (tuple(sorted(self.chars)), self.negated)
+        return 'CharSet(%r, negated=%r)' % (self._sorted_chars, self.negated)
 
 
+# Stored as frozensets, so CharSet doesn't need to copy them.
 charclasses = {
-    c: ''.join(filter(re.compile(r'\%s' % c).match, string.printable))
+    c: frozenset(filter(re.compile(r'\%s' % c).match, string.printable))
     for c in 'swd'
-}
+}  # type: Dict[String, FrozenSet[String]]
 
 
 @six.python_2_unicode_compatible
 class CharClass(CharSet):
-    def __new__(cls, char):
-        negated = char.isupper()
-        chars = charclasses[char.lower()]
-        instance = super(CharClass, cls).__new__(cls, chars, negated)
-        instance.charclass = char
-        return instance
+    __slots__ = ('charclass', )
 
-    @property
-    def identity_tuple(self):
-        return (CharClass.__name__, self.negated, self.charclass)
+    # There are only six charclasses, so keep them alive rather than rebuilding
+    # (and resorting) them whenever the last reference goes away.
+    _instances = {}  # type: Dict[String, CharClass]
+
+    def __new__(cls, char):
+        try:
+            return cls._instances[char]
+        except KeyError:
+            negated = char.isupper()
+            chars = charclasses[char.lower()]
+            instance = super(CharClass, cls).__new__(cls, chars, negated)
+            instance.charclass = char
+            cls._instances[char] = instance
+            return instance
 
     def __str__(self):
         if len(self.chars) == 1 and not self.negated:
-            return six.text_type(self.chars[0])
+            return six.text_type(self._sorted_chars[0])
         return '\\%s' % self.charclass
 
     def __repr__(self):
@@ -450,45 +788,70 @@ class CharClass(CharSet):
 
 @six.python_2_unicode_compatible
 class Union(RegularExpression):
-    children = None  # type: Tuple[RegularExpression, ...]
+    __slots__ = ('children', 'accepting', 'has_lookahead', 'has_lookbehind')
 
     def __new__(cls, *children):  # type: (*RegularExpression) -> RegularExpression
+        if len(children) == 1:
+            return children[0]
+        elif children and all(type(child) is CharSet and not child.negated for child in children):
+            # Fast path for sets like [a-z0-9_], which are parsed as a union of
+            # their items.
+            return CharSet(frozenset().union(*(child.chars for child in children)))
         flattened_children = set()  # type: Set[RegularExpression]
         for child in children:
             if isinstance(child, Union):
-                flattened_children |= set(child.children)
+                flattened_children.update(child.children)
             else:
                 flattened_children.add(child)
         if flattened_children == {EMPTY}:
             return EMPTY
-        elif EMPTY in children:
-            flattened_children.remove(EMPTY)
+        flattened_children.discard(EMPTY)
+        if any(isinstance(child, Complement) and child.regex in flattened_children
+               for child in flattened_children):
+            # R | ~R matches every string.
+            return WHATEVER
 
         char_literals = {
             child for child in flattened_children
             if (isinstance(child, CharSet) and not child.negated)}
-        if char_literals:
-            chars = {char for literal in char_literals for char in literal.chars}
+        if len(char_literals) > 1:
+            chars = frozenset().union(*(literal.chars for literal in char_literals))
             flattened_children = flattened_children - char_literals
             flattened_children.add(CharSet(chars))
-        children = tuple(sorted(flattened_children))
-        if len(children) == 1:
-            return children[0]
-
+        if len(flattened_children) == 1:
+            return flattened_children.pop()
+        else:
+            # Factor out charsets shared by the start of several alternatives,
+            # so ab|ac|ad|e becomes a(b|c|d)|e. Then taking the derivative of a
+            # long alternation of strings only visits the alternatives which
+            # can consume the char, as in a trie. This is applied to every
+            # union, so an already factored child like a(b|c|d) is merged with
+            # the other alternatives starting with a, and the result doesn't
+            # depend on how the alternatives were grouped.
+            by_head = OrderedDict()  # type: Dict[RegularExpression, List[Concatenation]]
+            for child in flattened_children:
+                if isinstance(child, Concatenation) and isinstance(child.children[0], CharSet):
+                    by_head.setdefault(child.children[0], []).append(child)
+            if any(len(concatenations) > 1 for concatenations in by_head.values()):
+                for head, concatenations in by_head.items():
+                    if len(concatenations) > 1:
+                        flattened_children.difference_update(concatenations)
+                        flattened_children.add(head + Union(*[c.tail for c in concatenations]))
+                return Union(*flattened_children)
+
+        # As with Intersection, only sort the children of new instances.
         instance = super(Union, cls).__new__(cls)
-        instance.children = children
-        return instance
+        instance.identity_tuple = (cls, frozenset(flattened_children))
+        interned = instance._intern()
+        if interned is instance:
+            instance.children = tuple(sorted(flattened_children, key=attrgetter('_uid')))
+            instance.accepting = any(child.accepting for child in flattened_children)
+            instance.has_lookahead = any(child.has_lookahead for child in flattened_children)
+            instance.has_lookbehind = any(child.has_lookbehind for child in flattened_children)
+        return interned
 
     is_atomic = False
 
-    @property
-    def has_lookahead(self):  # type: () -> bool
-        return any(child.has_lookahead for child in self.children)
-
-    @property
-    def has_lookbehind(self):  # type: () -> bool
-        return any(child.has_lookbehind for child in self.children)
-
     def __add__(self, other):
         lookaheads = tuple(r for r in self.children if r.has_lookahead)
         if lookaheads:
@@ -499,27 +862,37 @@ class Union(RegularExpression):
         else:
             return Concatenation(self, other)
 
-    @property
-    def accepting(self):
-        return any(child.accepting for child in self.children)
+    def _derivative(self, char):  # type: (String) -> RegularExpression
+        return Union(*[child.derivative(char) for child in self.children])
 
-    def derivative(self, char):  # type: (String) -> RegularExpression
-        return reduce(operator.or_, (child.derivative(char) for child in self.children))
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return frozenset().union(*(child.distinguished_sets for child in self.children))
 
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.children)
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return _union_first_chars(self.children)
 
+    def _compute_required_literal(self):  # type: () -> String
+        # Only a literal required by every alternative is required, and the
+        # shortest is the only candidate.
+        literals = [child.required_literal for child in self.children]
+        if not literals:
+            return ''
+        shortest = min(literals, key=len)
+        return shortest if all(shortest in literal for literal in literals) else ''
+
+    # As with Intersection, render the children in a stable order.
+    @_memoize_string
     def __str__(self):
-        return '|'.join(map(parenthesize_str, self.children))
+        return '|'.join(sorted(map(parenthesize_str, self.children)))
 
+    @_memoize_string
     def __repr__(self):
-        return '|'.join(map(parenthesize_repr, self.children))
+        return '|'.join(sorted(map(parenthesize_repr, self.children)))
 
 
 @six.python_2_unicode_compatible
 class Complement(RegularExpression):
-    regex = None  # type: RegularExpression
+    __slots__ = ('regex', 'accepting', 'has_lookahead', 'has_lookbehind')
 
     def __new__(cls, regex):
         """
@@ -527,77 +900,84 @@ class Complement(RegularExpression):
         representation.
         """
         if isinstance(regex, Intersection):
-            return reduce(operator.or_, (~child for child in regex.children))
+            return Union(*[~child for child in regex.children])
         elif isinstance(regex, Union):
-            return reduce(operator.and_, (~child for child in regex.children))
+            return Intersection(*[~child for child in regex.children])
         elif isinstance(regex, Complement):
             return regex.regex
         else:
             instance = super(Complement, cls).__new__(cls)
             instance.regex = regex
-            return instance
-
-    @property
-    def has_lookahead(self):  # type: () -> bool
-        return self.regex.has_lookahead
-
-    @property
-    def has_lookbehind(self):  # type: () -> bool
-        return self.regex.has_lookbehind
+            instance.accepting = not regex.accepting
+            instance.has_lookahead = regex.has_lookahead
+            instance.has_lookbehind = regex.has_lookbehind
+            instance.identity_tuple = (cls, regex)
+            return instance._intern()
 
     @property
     def is_atomic(self):
         return self.regex.is_atomic
 
-    @property
-    def accepting(self):
-        return not self.regex.accepting
-
-    def derivative(self, char):  # type: (String) -> RegularExpression
+    def _derivative(self, char):  # type: (String) -> RegularExpression
         return ~self.regex.derivative(char)
 
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.regex)
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return self.regex.distinguished_sets
+
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return None
 
+    @_memoize_string
     def __str__(self):
         return '~%s' % parenthesize_str(self.regex)
 
+    @_memoize_string
     def __repr__(self):
         return '~%s' % parenthesize_repr(self.regex)
 
 
 @six.python_2_unicode_compatible
 class Star(RegularExpression):
-    regex = None  # type: RegularExpression
+    __slots__ = ('regex', 'has_lookahead', 'has_lookbehind')
 
     def __new__(cls, regex):
         if regex is EMPTY or regex is EPSILON:
             return regex
         instance = super(Star, cls).__new__(cls)
         instance.regex = regex
-        return instance
+        instance.has_lookahead = regex.has_lookahead
+        instance.has_lookbehind = regex.has_lookbehind
+        instance.identity_tuple = (cls, regex)
+        return instance._intern()
 
     accepting = True
 
-    @property
-    def has_lookahead(self):  # type: () -> bool
-        return self.regex.has_lookahead
-
-    @property
-    def has_lookbehind(self):  # type: () -> bool
-        return self.regex.has_lookbehind
-
-    def derivative(self, char):  # type: (String) -> RegularExpression
-        return self.regex.derivative(char) + self
-
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.regex)
-
+    def _derivative(self, char):  # type: (String) -> RegularExpression
+        derivative = self.regex.derivative(char)
+        # Handle the common cases without going through Concatenation.
+        if derivative is EMPTY:
+            return EMPTY
+        elif derivative is EPSILON:
+            return self
+        elif derivative.has_lookahead or derivative.has_lookbehind or self.has_lookbehind:
+            return derivative + self
+        # Without lookarounds, R'R* is already in normal form, so skip the
+        # flattening and collapsing in Concatenation.__new__.
+        elif isinstance(derivative, Concatenation):
+            return Concatenation._from_normalized_children(derivative.children + (self,))
+        return Concatenation._from_normalized_children((derivative, self))
+
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return self.regex.distinguished_sets
+
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return self.regex.first_chars
+
+    @_memoize_string
     def __str__(self):
         return '%s*' % parenthesize_str(self.regex)
 
+    @_memoize_string
     def __repr__(self):
         return 'Star(%r)' % self.regex
 
@@ -607,9 +987,7 @@ WHATEVER = Star(DOT)
 
 @six.python_2_unicode_compatible
 class LookAhead(RegularExpression):
-    accepting = None  # type: bool
-    lookaround_re = None  # type: RegularExpression
-    suffix = None  # type: RegularExpression
+    __slots__ = ('lookaround_re', 'suffix', 'accepting')
 
     def __new__(cls, lookaround_re, suffix):
         instance = super(LookAhead, cls).__new__(cls)
@@ -626,7 +1004,8 @@ class LookAhead(RegularExpression):
         instance.lookaround_re = lookaround_re
         instance.suffix = suffix
         instance.accepting = accepting
-        return instance
+        instance.identity_tuple = (cls, lookaround_re, suffix)
+        return instance._intern()
 
     has_lookahead = True
 
@@ -647,31 +1026,36 @@ class LookAhead(RegularExpression):
                 return children[:index] + (new_lookahead, )
         return children
 
-    def derivative(self, char):
+    def _derivative(self, char):
         look_der = self.lookaround_re.derivative(char)
         post_der = self.suffix.derivative(char)
         return LookAhead(look_der, post_der)
 
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return self.lookaround_re.distinguished_sets | self.suffix.distinguished_sets
+
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return _intersect_first_chars([self.lookaround_re, self.suffix])
+
+    def _compute_required_literal(self):  # type: () -> String
+        return max([self.lookaround_re.required_literal, self.suffix.required_literal], key=len)
+
+    @_memoize_string
     def __repr__(self):
         return 'LookAhead(%r, %r)' % (self.lookaround_re, self.suffix)
 
+    @_memoize_string
     def __str__(self):
         # TODO: show negative lookahead as (?!...) instead of (?=~...)
         return '(?=%s)%s' % (self.lookaround_re, self.suffix)
 
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.lookaround_re, self.suffix)
-
     def __add__(self, other):
         return LookAhead(self.lookaround_re, self.suffix + other)
 
 
 @six.python_2_unicode_compatible
 class LookBehind(RegularExpression):
-    accepting = None  # type: bool
-    lookaround_re = None  # type: RegularExpression
-    prefix = None  # type: RegularExpression
+    __slots__ = ('prefix', 'lookaround_re', 'accepting')
 
     def __new__(cls, prefix, lookaround_re):
         instance = super(LookBehind, cls).__new__(cls)
@@ -684,7 +1068,8 @@ class LookBehind(RegularExpression):
         instance.lookaround_re = lookaround_re
         instance.prefix = prefix
         instance.accepting = accepting
-        return instance
+        instance.identity_tuple = (cls, prefix, lookaround_re)
+        return instance._intern()
 
     has_lookbehind = True
 
@@ -705,171 +1090,26 @@ class LookBehind(RegularExpression):
                 return (new_lookbehind, ) + children[index + 1:]
         return children
 
-    def derivative(self, char):
+    def _derivative(self, char):
         return LookBehind(
             prefix=self.prefix.derivative(char),
             lookaround_re=self.lookaround_re.derivative(char),
         )
 
+    def _compute_distinguished_sets(self):  # type: () -> FrozenSet[FrozenSet[String]]
+        return self.prefix.distinguished_sets | self.lookaround_re.distinguished_sets
+
+    def _compute_first_chars(self):  # type: () -> Optional[FrozenSet[String]]
+        return _intersect_first_chars([self.prefix, self.lookaround_re])
+
+    def _compute_required_literal(self):  # type: () -> String
+        return max([self.prefix.required_literal, self.lookaround_re.required_literal], key=len)
+
+    @_memoize_string
     def __repr__(self):
         return 'LookBehind(%r, %r)' % (self.prefix, self.lookaround_re, )
 
+    @_memoize_string
     def __str__(self):
         # TODO: show negative lookbehind as (<!...) instead of (<=~...)
         return '%s(?<=%s)' % (self.prefix, self.lookaround_re)
-
-    @property
-    def identity_tuple(self):
-        return (type(self).__name__, self.prefix, self.lookaround_re)
-
-
-class RegexVisitor(NodeVisitor):
-    grammar = REGEX
-
-    def parse(self, regex):  # type: (String) -> RegularExpression
-        return super(RegexVisitor, self).parse(regex)
-
-    def visit_re(self, node, children):
-        [re] = children
-        return re
-
-    def visit_concatenation(self, node, children):
-        return reduce(operator.add, [re for [re] in children], EPSILON)
-
-    def visit_lookahead(self, node, children):
-        # lookahead = "(" "?=" re ")"
-        lparen, [quantifier], lookaround_re, rparen = children
-        if quantifier == "?!":
-            lookaround_re = ~(lookaround_re + WHATEVER)
-            return LookAhead(lookaround_re, EPSILON)
-        elif quantifier == '?=':
-            lookaround_re = lookaround_re + WHATEVER
-            return LookAhead(lookaround_re, EPSILON)
-        elif quantifier == "?<=":
-            lookaround_re = WHATEVER + lookaround_re
-            return LookBehind(EPSILON, lookaround_re)
-        elif quantifier == "?<!":
-            lookaround_re = ~(WHATEVER + lookaround_re)
-            return LookBehind(EPSILON, lookaround_re)
-        else:
-            raise NotImplementedError(quantifier)
-
-    def visit_comment(self, node, children):
-        # Just ignore the comment text and return a zero-character regex.
-        return EPSILON
-
-    def visit_group(self, node, children):
-        lparen, _, re, rparen = children
-        return re
-
-    def visit_charclass(self, node, children):
-        slash, charclass = children
-        return CharClass(charclass)
-
-    def visit_union(self, node, children):
-        disjuncts = []
-        # This is sort of ugly; parsimonious returns children as a list
-        # of all its left disjuncts (including the | character) and the final one
-        # (sans pipe character).
-        disjuncts_and_pipes, last_disjunct = children
-        for (disjunct, superfluous_pipe) in disjuncts_and_pipes:
-            disjuncts.append(disjunct)
-        disjuncts.append(last_disjunct)
-        return reduce(operator.or_, disjuncts)
-
-    def visit_quantified(self, node, children):
-        regex, quantifier = children
-        if quantifier == '?':
-            return regex | EPSILON
-        elif quantifier == '*':
-            return Star(regex)
-        elif quantifier == '+':
-            return regex + Star(regex)
-        else:
-            raise NotImplementedError('Unhandled quanitifier %s' % quantifier)
-
-    def visit_literal(self, node, children):
-        # Why doesn't parsimonious do this for you?
-        [child] = children
-        return child
-
-    def visit_escaped_character(self, node, children):
-        [char] = children
-        return CharSet([char])
-
-    def visit_escaped_metachar(self, node, children):
-        slash, char = children
-        return char
-
-    def visit_escaped_numeric_character(self, node, children):
-        [[escape, character_code]] = children
-        if escape == '\\':
-            # Octal escape code like '\077'
-            return chr(int(character_code, 8))
-        elif escape in ('\\u', '\\x', '\\U'):
-            # hex escape like '\xff'
-            return chr(int(character_code, 16))
-        else:
-            raise NotImplementedError('Unhandled character escape %s' % escape)
-
-    def visit_escaped_whitespace(self, node, children):
-        slash, char = children
-        return literal_eval('"\%s"' % char)  # type: ignore
-
-    def visit_escaped_set_char(self, node, children):
-        slash, char = node.text
-        return char
-
-    def visit_character(self, node, children):
-        char = node.text
-        assert len(char) == 1, 'bug %s' % char
-        if char == '.':
-            return DOT
-        else:
-            return CharSet(node.text)
-
-    def visit_set_char(self, node, children):
-        [char] = children
-        return char
-
-    def visit_range(self, node, children):
-        start, dash, end = children
-        return CharSet([chr(i) for i in range(ord(start), ord(end) + 1)])
-
-    def visit_set_items(self, node, children):
-        items = [
-            item if isinstance(item, RegularExpression) else CharSet([item])
-            for item, in children]
-        return reduce(operator.or_, items)
-
-    def visit_character_set(self, node, children):
-        [lbrac, negated, inner, rbrac] = children
-        if negated:
-            return CharSet(inner.chars, negated=True)
-        else:
-            return inner
-
-    def visit_repeat_fixed(self, node, children):
-        regex, lbrac, repeat_count, rbrac = children
-        repeat_count = int(repeat_count)
-        if repeat_count == 0:
-            raise ValueError('Invalid repeat %s' % node.text)
-        return regex * repeat_count
-
-    def visit_repeat_range(self, node, children):
-        regex, lbrac, min_repeat, comma, max_repeat, rbrac = children
-        min_repeat = int(min_repeat or '0')
-        max_repeat = None if not max_repeat else int(max_repeat)
-        repeated = regex * min_repeat
-        if max_repeat is None:
-            # Open ended range, like /a{4,}/
-            opt = Star(regex)
-        else:
-            opt = reduce(
-                operator.or_,
-                [regex * repeat for repeat in range(0, max_repeat - min_repeat + 1)])
-
-        return repeated + opt
-
-    def generic_visit(self, node, children):
-        return children or node.text
@@ -6,6 +6,7 @@ import re
 from collections import defaultdict
 from typing import Any  # noqa
 from typing import Dict  # noqa
+from typing import Iterable  # noqa
 from typing import List  # noqa
 from typing import Optional  # noqa
 from typing import Sequence  # noqa
@@ -15,9 +16,15 @@ from typing import Generic
 
 import six
 import networkx as nx
+import numpy as np
 import typing  # noqa
 from six.moves import range
 
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -46,12 +53,53 @@ DEFAULT_ALPHABET = list(
     filter(re.compile(r'[ -~]').match, map(chr, range(0, 128))))  # type: Sequence[str]
 
 
+def _run_table(table, buf, state):
+    """
+    Follows the transitions in `table`, an array of (state, byte): next state,
+    from `state` over the bytes in `buf`.
+
+    Returns the final state, or -1 - i if there is no transition for buf[i].
+    This is compiled with numba when it is installed.
+    """
+    for i in range(len(buf)):
+        state = table[state, buf[i]]
+        if state < 0:
+            return -1 - i
+    return state
+
+
+if numba is not None:  # pragma: no cover
+    _run_table = numba.njit(cache=True)(_run_table)
+
+
+def _collapse_ranges(chars):  # type: (Iterable[String]) -> String
+    """
+    Returns a compact label for a set of chars, writing runs of three or more
+    consecutive chars as ranges, e.g. "a-e0xy".
+    """
+    runs = []  # type: List[List[String]]
+    for char in sorted(chars):
+        if runs and ord(char) == ord(runs[-1][1]) + 1:
+            runs[-1][1] = char
+        else:
+            runs.append([char, char])
+    return ''.join(
+        start if start == end else
+        start + end if ord(end) == ord(start) + 1 else
+        '%s-%s' % (start, end)
+        for start, end in runs
+    )
+
+
 class DFA(Generic[NodeType], nx.MultiDiGraph):
     node = None  # type: Dict[NodeType, Dict[Any, Any]]
 
     def __init__(self, start, start_accepting, alphabet=DEFAULT_ALPHABET):
         # type: (NodeType, bool, Sequence[String]) -> None
         super(DFA, self).__init__()
+        # Kept up to date by add_state, so the accepting states don't need to be
+        # found by scanning the node attributes.
+        self._accepting_states = set()  # type: Set[NodeType]
         self.start = start  # type: NodeType
         self.add_state(start, start_accepting)
 
@@ -80,23 +128,50 @@ class DFA(Generic[NodeType], nx.MultiDiGraph):
 
     @property
     def _acceptable_subgraph(self):  # type:  () -> nx.MultiDiGraph
-        graph = self.as_multidigraph
-        reachable_states = nx.descendants(graph, self.start) | {self.start}
-        graph = graph.subgraph(reachable_states)
-        reachable_accepting_states = reachable_states & {
-            node for node in graph.node if graph.node[node]['accepting']
-        }
-
-        # Add a "sink" node with an in-edge from every accepting state. This is
-        # is solely done because the networkx API makes it easier to find the
-        # ancestor of a node than a set of nodes.
-        sink = object()
-        graph.add_node(sink)
-        for state in reachable_accepting_states:
-            graph.add_edge(state, sink)
-
-        acceptable_sates = nx.ancestors(graph, sink)
-        return graph.subgraph(acceptable_sates)
+        """
+        The subgraph of states which are reachable from the start state and can
+        reach an accepting state. This is cached until a state or transition is
+        added, and must not be modified.
+        """
+        if self._cached_acceptable_subgraph is None:
+            self._cached_acceptable_subgraph = self._compute_acceptable_subgraph()
+        return self._cached_acceptable_subgraph
+
+    def _compute_acceptable_subgraph(self):  # type:  () -> nx.MultiDiGraph
+        reachable_states = nx.descendants(self, self.start) | {self.start}
+        reachable_accepting_states = reachable_states & self._accepting_states
+        # Every state on a path from a reachable state is reachable, so this is
+        # the same as restricting to reachable states before searching back.
+        acceptable_states = self._coreachable_states(reachable_accepting_states) & reachable_states
+        return self._induced_multidigraph(acceptable_states)
+
+    def _coreachable_states(self, states):  # type: (Set[NodeType]) -> Set[NodeType]
+        """
+        Returns the states from which some state in `states` can be reached,
+        including `states` themselves.
+        """
+        coreachable = set(states)
+        to_explore = list(coreachable)
+        while to_explore:
+            for previous_state in self.pred[to_explore.pop()]:
+                if previous_state not in coreachable:
+                    coreachable.add(previous_state)
+                    to_explore.append(previous_state)
+        return coreachable
+
+    def _induced_multidigraph(self, states):  # type: (Set[NodeType]) -> nx.MultiDiGraph
+        """
+        Constructs a MultiDiGraph copy of the subgraph of self on `states`,
+        without copying the rest of the graph first.
+        """
+        graph = nx.MultiDiGraph()
+        graph.add_nodes_from((state, self.node[state]) for state in states)
+        graph.add_edges_from(
+            (from_state, to_state, data)
+            for from_state, to_state, data in self.edges(states, data=True)
+            if to_state in states
+        )
+        return graph
 
     @property
     def has_finite_language(self):  # type: () -> bool
@@ -167,7 +242,7 @@ class DFA(Generic[NodeType], nx.MultiDiGraph):
         chars = []
         for state1, state2 in zip(longest_path, longest_path[1:]):
             edges = self.succ[state1][state2]
-            chars.append(next(six.itervalues(edges))['transition'])
+            chars.append(min(next(six.itervalues(edges))['transition']))
         return type(self.alphabet[0])().join(chars)
 
     @property
@@ -181,23 +256,18 @@ class DFA(Generic[NodeType], nx.MultiDiGraph):
         might lead to an accepting state, or just the start state if no such
         paths exist.
         """
-        graph = self.as_multidigraph
-        accepting_states = {
-            node for node in graph.node if graph.node[node]['accepting']
-        }
-
-        # Add a "sink" node with an in-edge from every accepting state. This is
-        # is solely done because the networkx API makes it easier to find the
-        # ancestor of a node than a set of nodes.
-        sink = object()
-        graph.add_node(sink)
-        for state in accepting_states:
-            graph.add_edge(state, sink)
-
-        live_states = {self.start} | (nx.ancestors(graph, sink) & nx.descendants(graph, self.start))
-        return graph.subgraph(live_states)
+        live_states = (
+            {self.start} |
+            (self._coreachable_states(self._accepting_states) & nx.descendants(self, self.start)))
+        return self._induced_multidigraph(live_states)
 
     def add_state(self, state, accepting):  # type: (NodeType, bool) -> None
+        self._matcher = None  # type: Optional[typing.Callable[[String], bool]]
+        self._cached_acceptable_subgraph = None  # type: Optional[nx.MultiDiGraph]
+        if accepting:
+            self._accepting_states.add(state)
+        else:
+            self._accepting_states.discard(state)
         self.add_node(
             state,
             attr_dict={
@@ -210,27 +280,103 @@ class DFA(Generic[NodeType], nx.MultiDiGraph):
 
     def add_transition(self, from_state, to_state, char):
         # type: (NodeType, NodeType, String) -> None
+        self.add_transitions(from_state, to_state, [char])
+
+    def add_transitions(self, from_state, to_state, chars):
+        # type: (NodeType, NodeType, Iterable[String]) -> None
+        """
+        Adds a transition from `from_state` to `to_state` on each of `chars`,
+        checking the states and adding the edges in one pass.
+        """
         if not (self.has_node(from_state) and self.has_node(to_state)):
             raise ValueError('States must be added prior to transitions.')
-        if self.delta[from_state].get(char) == to_state:
-            # Transition already present.
+        transitions = self.delta[from_state]
+        new_chars = []  # type: List[String]
+        for char in chars:
+            existing = transitions.get(char)
+            if existing == to_state:
+                # Transition already present.
+                continue
+            elif existing is not None:
+                raise ValueError('Already have a transition.')
+            transitions[char] = to_state
+            new_chars.append(char)
+        if not new_chars:
             return
-        elif self.delta[from_state].get(char) is not None:
-            raise ValueError('Already have a transition.')
-        self.delta[from_state][char] = to_state
+        self._matcher = None
+        self._cached_acceptable_subgraph = None
+        # All the transitions between two states share a single edge, labeled
+        # with the set of chars.
+        edges = self.succ[from_state].get(to_state)
+        transition = frozenset(new_chars)
+        if edges:
+            transition |= edges[0]['transition']
         self.add_edge(
-            from_state, to_state,
+            from_state, to_state, key=0,
             attr_dict={
-                'transition': char,
-                'label': ' %s ' % char,
+                'transition': transition,
+                'label': ' %s ' % _collapse_ranges(transition),
             }
         )
 
     def match(self, string):  # type: (String) -> bool
-        node = self.start
-        for i in range(len(string)):
-            node = self.delta[node][string[i:i + 1]]
-        return self.node[node]['accepting']
+        if self._matcher is None:
+            self._matcher = self._compile_matcher()
+        return self._matcher(string)
+
+    def _compile_matcher(self):  # type: () -> typing.Callable[[String], bool]
+        """
+        Builds a matching function over a copy of the transitions with the
+        states numbered by integers, so each char matched costs one list index
+        and one dict lookup, rather than hashing an arbitrary state object.
+
+        The matcher is cached until a state or transition is added.
+        """
+        index = {state: i for i, state in enumerate(self.nodes())}
+        transitions = [{} for _ in index]  # type: List[Dict[String, int]]
+        for state, i in index.items():
+            for char, next_state in self.delta.get(state, {}).items():
+                transitions[i][char] = index[next_state]
+        accepting = frozenset(index[state] for state in self._accepting_states)
+        chars = {char for state_transitions in transitions for char in state_transitions}
+        if numba is not None and all(len(char) == 1 and ord(char) < 128 for char in chars):
+            return self._compile_numba_matcher(index[self.start], transitions, accepting)
+
+        def match(string, state=index[self.start], transitions=transitions, accepting=accepting):
+            # type: (String, int, List[Dict[String, int]], typing.FrozenSet[int]) -> bool
+            for char in string:
+                state = transitions[state][char]
+            return state in accepting
+
+        return match
+
+    @staticmethod
+    def _compile_numba_matcher(start, transitions, accepting):
+        # type: (int, List[Dict[String, int]], typing.FrozenSet[int]) -> typing.Callable[[String], bool]
+        """
+        Builds a matcher for an ASCII-only transition table, which runs the
+        per-character loop as compiled code.
+        """
+        table = np.full((len(transitions), 128), -1, dtype=np.int32)
+        for i, state_transitions in enumerate(transitions):
+            for char, next_state in state_transitions.items():
+                table[i, ord(char)] = next_state
+        accepting_states = np.zeros(len(transitions), dtype=np.bool_)
+        accepting_states[list(accepting)] = True
+
+        def match(string):  # type: (String) -> bool
+            try:
+                buf = np.frombuffer(string.encode('ascii'), dtype=np.uint8)
+            except UnicodeEncodeError as e:
+                # There are only transitions for ASCII chars.
+                raise KeyError(string[e.start])
+            state = _run_table(table, buf, start)
+            if state < 0:
+                # Consistent with the dict based matcher.
+                raise KeyError(string[-1 - state])
+            return bool(accepting_states[state])
+
+        return match
 
     def _draw(self, full=False):  # pragma: no cover
         # type: (bool) -> None
@@ -282,8 +428,8 @@ class DFA(Generic[NodeType], nx.MultiDiGraph):
         invalid_nodes = []
         alphabet = set(self.alphabet)
         for from_node in self.nodes():
-            trans = self.delta[from_node]
-            if set(trans) != alphabet:
+            # Compare the keys view directly, rather than copying it to a set.
+            if six.viewkeys(self.delta.get(from_node, {})) != alphabet:
                 invalid_nodes.append(from_node)
         return invalid_nodes
 
@@ -315,56 +461,87 @@ class DFA(Generic[NodeType], nx.MultiDiGraph):
         return isomorphism
 
 
-def get_equivalent_states(dfa):
-    # type: (DFA[NodeType]) -> Set[tuple[NodeType, NodeType]]
+def _hopcroft_partition(dfa):  # type: (DFA[NodeType]) -> List[typing.FrozenSet[NodeType]]
     """
-    Return equivalent states in the DFA, as constructed using Hopcroft's
-    algorithm. See https://en.wikipedia.org/wiki/DFA_minimization
+    Partitions the states of the DFA into classes of equivalent states, using
+    Hopcroft's partition refinement algorithm. See
+    https://en.wikipedia.org/wiki/DFA_minimization#Hopcroft's_algorithm
 
-    See also http://www8.cs.umu.se/kurser/TDBC92/VT06/final/1.pdf and
-    https://cse.sc.edu/~fenner/csce551/minimization.pdf for more background.
+    Two states p and q are _equivalent_ iff for every string S, starting off
+    at p and q, S is either accepted from both or rejected from both.
 
-    TODO: this algorithm does twice as much work as needed by not ordering
-    the states.
+    Every state must have a transition for every char in the alphabet.
     """
     states = list(dfa.nodes())
-    F = {state for state in states if dfa.node[state]['accepting']}
+    index = {state: i for i, state in enumerate(states)}
+
+    # inverse[char][q] lists the states with a transition to q on char.
+    inverse = {char: [[] for _ in states] for char in dfa.alphabet}
+    for state in states:
+        for char, next_state in dfa.delta[state].items():
+            if char in inverse:
+                inverse[char][index[next_state]].append(index[state])
+
+    # Start by separating accepting and non-accepting states, which are
+    # distinguished by the empty string.
+    accepting = {index[state] for state in dfa._accepting_states}
+    blocks = sorted(
+        [block for block in (accepting, set(range(len(states))) - accepting) if block],
+        key=len, reverse=True)
+    block_of = [0] * len(states)
+    for b, block in enumerate(blocks):
+        for q in block:
+            block_of[q] = b
+
+    # Refine the partition until it is consistent with every splitter. When a
+    # block is split, only the smaller part needs to be added to the worklist:
+    # splitting by it and by the whole block distinguishes the larger part too.
+    # In particular, only the smaller of the initial blocks is needed.
+    worklist = list(range(1, len(blocks)))
+    while worklist:
+        splitter = list(blocks[worklist.pop()])
+        for inverse_transitions in inverse.values():
+            # Group the states which transition into the splitter by block.
+            touched = defaultdict(set)  # type: defaultdict[int, Set[int]]
+            for a in splitter:
+                for q in inverse_transitions[a]:
+                    touched[block_of[q]].add(q)
+            for b, inside in touched.items():
+                block = blocks[b]
+                if len(inside) == len(block):
+                    continue
+                outside = block - inside
+                if len(inside) <= len(outside):
+                    smaller, larger = inside, outside
+                else:
+                    smaller, larger = outside, inside
+                # The larger part keeps the block's index (and place on the
+                # worklist, if any). The smaller part always goes on it.
+                blocks[b] = larger
+                new_b = len(blocks)
+                blocks.append(smaller)
+                for q in smaller:
+                    block_of[q] = new_b
+                worklist.append(new_b)
+
+    return [frozenset(states[q] for q in block) for block in blocks]
 
-    # Two nodes p and q in the DFA are considered _equivalent_ iff for every
-    # string S=c0c1c2...ck, starting off at p and q are always accepting or not
-    # accepting.
 
-    # Start off assuming that _all_ node pairs are equivalent, then search for
-    # disproofs of equivalency.
-    equivalent = {
-        (p, q) for p in states for q in states
+def get_equivalent_states(dfa):
+    # type: (DFA[NodeType]) -> Set[tuple[NodeType, NodeType]]
+    """
+    Return equivalent states in the DFA, as pairs (p, q), including (p, p).
 
-        # First remove pairs whose equivalence is disproved by the empty string
-        # (i.e. one is an accepting state and the other is not).
-        if (p in F) == (q in F)
+    See also http://www8.cs.umu.se/kurser/TDBC92/VT06/final/1.pdf and
+    https://cse.sc.edu/~fenner/csce551/minimization.pdf for more background.
+    """
+    return {
+        (p, q)
+        for equivalency_class in _hopcroft_partition(dfa)
+        for p in equivalency_class
+        for q in equivalency_class
     }
 
-    def delta(state, char):  # type: (NodeType, String) -> NodeType
-        return dfa.delta[state][char]
-
-    # Now proceed in a backtracking search for all 1-character disproofs of
-    # equivalency, 2-character disproofs, and so on. When no new disproofs are
-    # found, we are done.
-    found_disproof = True
-    while found_disproof:
-        found_disproof = False
-        to_disprove = set(equivalent)
-        while to_disprove:
-            p, q = to_disprove.pop()
-            to_disprove.discard((q, p))
-            for a in dfa.alphabet:
-                if (delta(p, a), delta(q, a)) not in equivalent:
-                    equivalent.remove((p, q))
-                    found_disproof = True
-                    break
-
-    return equivalent | {(q, p) for p, q in equivalent}
-
 
 T = typing.TypeVar('T')
 
@@ -373,24 +550,14 @@ def minimize_dfa(dfa):  # type: (DFA[T]) -> DFA[frozenset[T]]
     """
     Constructs a minimized DFA by combining equivalent states.
     """
-    equivalent_states = get_equivalent_states(dfa)
-    equivalency_classes = []  # type: List[frozenset[T]]
-    old_states = set(dfa.nodes())  # type: Set[T]
-    while old_states:
-        state = old_states.pop()
-        new_state = {state}
-        for (p, q) in equivalent_states:
-            if p == state:
-                new_state.add(q)
-                old_states.discard(q)
-        equivalency_classes.append(frozenset(new_state))
+    equivalency_classes = _hopcroft_partition(dfa)  # type: List[frozenset[T]]
     old_state_to_new_state = {
         state: new_state for new_state in equivalency_classes
         for state in new_state
     }  # type: Dict[T, frozenset[T]]
 
     def is_accepting(new_state):  # type: (frozenset[T]) -> bool
-        return dfa.node[next(iter(new_state))]['accepting']
+        return next(iter(new_state)) in dfa._accepting_states
 
     start = old_state_to_new_state[dfa.start]
     new_dfa = DFA(start, is_accepting(start), alphabet=dfa.alphabet)  # type: DFA[frozenset[T]]
@@ -6,7 +6,6 @@ import random
 from bisect import bisect_left
 from itertools import count
 
-import networkx as nx
 import numpy as np
 from six.moves import range
 from typing import Tuple, Dict, List, Union  # noqa
@@ -79,14 +78,19 @@ class PathWeights(object):
         """
         self.longest_path_length = 0
 
-        self.graph = dfa.as_multidigraph
         self.sink = len(dfa.nodes())
 
+        # The adjacency matrix counts the transitions between each pair of
+        # states, plus an edge from each accepting state to the sink. It's
+        # built from delta, since the DFA's graph has one edge per pair of
+        # states, however many chars it's labeled with.
+        self.matrix = np.zeros((self.sink + 1, self.sink + 1))
+        for state, transitions in dfa.delta.items():
+            for next_state in transitions.values():
+                self.matrix[state, next_state] += 1
         for state in dfa.nodes():
             if dfa.node[state]['accepting']:
-                self.graph.add_edge(state, self.sink)
-
-        self.matrix = nx.to_numpy_matrix(self.graph, nodelist=self.graph.nodes())
+                self.matrix[state, self.sink] = 1
         vect = np.zeros(self.matrix.shape[0])
         vect[-1] = 1.0  # Grabs the neighborhood of the sink node (last column).
         self.vects = [self.normalize_vector(self.matrix.dot(vect)).T]
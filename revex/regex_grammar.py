@@ -1,19 +1,54 @@
+# -*- coding: utf-8 -*-
+r"""
+Recursive descent parser for regular expressions.
+
+The accepted language is described by the following PEG, where each rule is
+implemented by the correspondingly named method of ``Parser``:
+
+    re = union / concatenation
+    union = (concatenation "|")+ concatenation
+    concatenation = (lookaround / quantified / repeat_fixed / repeat_range / atom)*
+    lookaround = "(" ("?=" / "?!" / "?<=" / "?<!") re ")"
+    quantified = atom ~"[*+?]"
+    repeat_fixed = atom "{" ~"\d+" "}"
+    repeat_range = atom "{" ~"(\d+)?" "," ~"(\d+)?" "}"
+
+    atom = comment / group / class / escaped_character / charclass / character
+    comment = "(?#" ("\)" / ~"[^)]")* ")"
+    group = ("(?:" / "(") !("?=" / "?!" / "?<=" / "?<!") re ")"
+
+    escaped_character = escaped_whitespace / escaped_metachar / escaped_numeric_character
+    escaped_whitespace = "\\" ~"[ntvr]"
+    escaped_metachar = "\\" ~"[<ESCAPABLE_CHARS>]"
+    escaped_numeric_character =
+        ("\\"  ~"[0-7]{3}") /
+        ("\\x" ~"[0-9a-f]{2}"i) /
+        ("\\u" ~"[0-9a-f]{4}"i) /
+        ("\\U" ~"[0-9a-f]{8}"i)
+    charclass = "\\" ~"[dDwWsS]"
+    character = ~"[^$^*+()|?]"
+
+    class = "[" "^"? set_items "]"
+    set_items = (range / charclass / escaped_numeric_character / escaped_whitespace / escaped_set_char / ~"[^\]]")+
+    range = set_char "-" set_char
+    set_char = escaped_numeric_character / escaped_set_char / ~"[^\]]"
+    escaped_set_char = "\\" ~"[<CHARSET_ESCAPABLE_CHARS>]"
+"""
 from __future__ import unicode_literals
 
+import operator
 import re
 import string
+from functools import reduce
+from typing import Dict, Optional  # noqa
 
-from parsimonious import Grammar
+from six import unichr as chr
 
-
-def double_regex_escape(char):
-    # This works around the fact that we're trying to include this as a
-    # regex inside a parsimonious grammar, so we escape odd characters to
-    # their hex representation rather than just using "\\".
-    if re.escape(char) != char:
-        return '\\\\x%0.2X' % ord(char)
-    else:
-        return char
+from revex.derivative import (
+    DOT, EMPTY, EPSILON, WHATEVER, CharClass, CharSet, Concatenation, LookAhead, LookBehind, Star, Union,
+)
+from revex.derivative import RegularExpression  # noqa
+from revex.dfa import RevexError, String  # noqa
 
 
 # Note: the collection of "escapable" characters differs between different
@@ -40,48 +75,289 @@ ESCAPABLE_CHARS = ''.join(filter(is_char_escapable, string.printable))
 CHARSET_ESCAPABLE_CHARS = ''.join(filter(is_char_escapable_in_charsets,
                                          string.printable))
 
+WHITESPACE_ESCAPES = {'n': '\n', 't': '\t', 'v': '\v', 'r': '\r'}
+CHARCLASSES = 'dDwWsS'
+LOOKAROUNDS = ('?=', '?!', '?<=', '?<!')
 
-REGEX = Grammar(r'''
-    re = union / concatenation
-    lookahead = "(" ("?=" / "?!" / "?<=" / "?<!") re ")"
-    union = (concatenation "|")+ concatenation
-    concatenation = (lookahead / quantified / repeat_fixed / repeat_range / literal)*
-    quantified = literal ~"[*+?]"
-    repeat_fixed = literal "{" ~"\d+" "}"
-    repeat_range = literal "{" ~"(\d+)?" "," ~"(\d+)?" "}"
-
-    literal =
-        comment /
-        group /
-        character_set /
-        escaped_character /
-        charclass /
-        character
+# Characters which cannot appear unescaped as a literal outside a set. Note
+# that a backslash which doesn't begin a valid escape is a literal backslash.
+METACHARS = '$^*+()|?'
 
-    group = ("(?:" / "(") !("?=" / "?!" / "?<=" / "?<!") re ")"
-    comment = "(?#" ("\)" / ~"[^)]")* ")"
+REPEAT_FIXED = re.compile(r'\{(\d+)\}')
+REPEAT_RANGE = re.compile(r'\{(\d+)?,(\d+)?\}')
+ESCAPED_NUMERIC_CHARACTER = re.compile(
+    r'\\(?:([0-7]{3})|x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8}))')
 
-    escaped_character =
-        escaped_whitespace /
-        escaped_metachar /
-        escaped_numeric_character
-    escaped_metachar = "\\" ~"[%s]"
-    escaped_numeric_character =
-        ("\\"  ~"[0-7]{3}") /
-        ("\\x" ~"[0-9a-f]{2}"i) /
-        ("\\u" ~"[0-9a-f]{4}"i) /
-        ("\\U" ~"[0-9a-f]{8}"i)
-    escaped_whitespace = "\\" ~"[ntvr]"
 
-    charclass = "\\" ~"[dDwWsS]"
-    character = ~"[^$^\\*+()|?]"
-    character_set = "[" "^"? set_items "]"
-    set_char = escaped_numeric_character / escaped_set_char / ~"[^\\]]"
-    escaped_set_char = "\\" ~"[%s]"
-    set_items = (range / charclass / escaped_numeric_character / escaped_whitespace / escaped_set_char / ~"[^\\]]" )+
-    range = set_char  "-" set_char
-''' % (  # noqa
-        ''.join(map(double_regex_escape, ESCAPABLE_CHARS)),
-        ''.join(map(double_regex_escape, CHARSET_ESCAPABLE_CHARS)),
-    )
-)
+class RegexSyntaxError(RevexError):
+    pass
+
+
+# Most of a typical regex is literal characters, so keep one CharSet alive per
+# character rather than constructing (and interning) a new one for each.
+_char_regexes = {}  # type: Dict[String, RegularExpression]
+
+
+def char_regex(char):  # type: (String) -> RegularExpression
+    try:
+        return _char_regexes[char]
+    except KeyError:
+        regex = _char_regexes[char] = CharSet([char])
+        return regex
+
+
+class Parser(object):
+    """
+    Parses a regex string directly into ``RegularExpression`` nodes.
+
+    Each ``parse_*`` method consumes the text matching its rule and returns the
+    corresponding regex; optional rules return ``None`` without advancing if
+    they don't match.
+    """
+    def __init__(self, regex):  # type: (String) -> None
+        self.regex = regex
+        self.pos = 0
+
+    def parse(self):  # type: () -> RegularExpression
+        parsed = self.parse_re()
+        if self.pos != len(self.regex):
+            raise self.error('Unexpected character')
+        return parsed
+
+    def error(self, message):  # type: (String) -> RegexSyntaxError
+        return RegexSyntaxError('%s at position %s of %r' % (message, self.pos, self.regex))
+
+    def peek(self, offset=0):  # type: (int) -> String
+        return self.regex[self.pos + offset:self.pos + offset + 1]
+
+    def consume(self, prefix):  # type: (String) -> bool
+        if self.regex.startswith(prefix, self.pos):
+            self.pos += len(prefix)
+            return True
+        return False
+
+    def expect(self, prefix):  # type: (String) -> None
+        if not self.consume(prefix):
+            raise self.error('Expected %r' % prefix)
+
+    def parse_re(self):  # type: () -> RegularExpression
+        disjuncts = [self.parse_concat()]
+        while self.consume('|'):
+            disjuncts.append(self.parse_concat())
+        return Union(*disjuncts)
+
+    def parse_concat(self):  # type: () -> RegularExpression
+        items = []
+        item = self.parse_item()
+        while item is not None:
+            items.append(item)
+            item = self.parse_item()
+        if any(item.has_lookahead or item.has_lookbehind for item in items):
+            # Lookarounds rely on __add__ to distribute over what follows them,
+            # so concatenate them one at a time.
+            return reduce(operator.add, items, EPSILON)
+        # Otherwise build the concatenation in one call. Adding pairwise would
+        # copy the children at every step, which is quadratic in the length.
+        return Concatenation(*items)
+
+    def parse_item(self):  # type: () -> Optional[RegularExpression]
+        lookaround = self.parse_lookaround()
+        if lookaround is not None:
+            return lookaround
+        start = self.pos
+        atom = self.parse_atom()
+        if atom is None:
+            return None
+        return self.parse_repeat(atom, start)
+
+    def parse_lookaround(self):  # type: () -> Optional[RegularExpression]
+        if self.peek() != '(':
+            return None
+        for quantifier in LOOKAROUNDS:
+            if self.regex.startswith(quantifier, self.pos + 1):
+                break
+        else:
+            return None
+        self.pos += 1 + len(quantifier)
+        lookaround_re = self.parse_re()
+        self.expect(')')
+        if quantifier == '?!':
+            return LookAhead(~(lookaround_re + WHATEVER), EPSILON)
+        elif quantifier == '?=':
+            return LookAhead(lookaround_re + WHATEVER, EPSILON)
+        elif quantifier == '?<=':
+            return LookBehind(EPSILON, WHATEVER + lookaround_re)
+        else:
+            return LookBehind(EPSILON, ~(WHATEVER + lookaround_re))
+
+    def parse_repeat(self, regex, start):
+        # type: (RegularExpression, int) -> RegularExpression
+        quantifier = self.peek()
+        if quantifier == '?':
+            self.pos += 1
+            return regex | EPSILON
+        elif quantifier == '*':
+            self.pos += 1
+            return Star(regex)
+        elif quantifier == '+':
+            self.pos += 1
+            return regex + Star(regex)
+
+        match = REPEAT_FIXED.match(self.regex, self.pos)
+        if match:
+            self.pos = match.end()
+            repeat_count = int(match.group(1))
+            if repeat_count == 0:
+                raise ValueError('Invalid repeat %s' % self.regex[start:self.pos])
+            return regex * repeat_count
+
+        match = REPEAT_RANGE.match(self.regex, self.pos)
+        if match:
+            self.pos = match.end()
+            min_repeat = int(match.group(1) or '0')
+            max_repeat = None if not match.group(2) else int(match.group(2))
+            repeated = regex * min_repeat
+            if max_repeat is None:
+                # Open ended range, like /a{4,}/
+                opt = Star(regex)
+            elif max_repeat < min_repeat:
+                raise ValueError('Invalid repeat %s' % self.regex[start:self.pos])
+            else:
+                # (R|ε){k} matches between 0 and k copies of R, and takes O(k) nodes
+                # to represent, as opposed to O(k²) for ε|R|RR|RRR|...
+                opt = (regex | EPSILON) * (max_repeat - min_repeat)
+            return repeated + opt
+
+        return regex
+
+    def parse_atom(self):  # type: () -> Optional[RegularExpression]
+        char = self.peek()
+        if char == '(':
+            return self.parse_group()
+        elif char == '\\':
+            escaped = self.parse_escape()
+            if escaped is not None:
+                return escaped
+        elif char == '[':
+            charset = self.parse_class()
+            if charset is not None:
+                return charset
+            # Otherwise an unterminated or empty set like /[a/ or /[]/ is
+            # parsed as a literal "[".
+        if not char or char in METACHARS:
+            return None
+        self.pos += 1
+        return DOT if char == '.' else char_regex(char)
+
+    def parse_group(self):  # type: () -> RegularExpression
+        if self.consume('(?#'):
+            # Just ignore the comment text and return a zero-character regex.
+            while not self.consume(')'):
+                if not self.consume('\\)'):
+                    if not self.peek():
+                        raise self.error('Unterminated comment')
+                    self.pos += 1
+            return EPSILON
+        if not self.consume('(?:'):
+            self.expect('(')
+        regex = self.parse_re()
+        self.expect(')')
+        return regex
+
+    def parse_escape(self):  # type: () -> Optional[RegularExpression]
+        char = self.peek(1)
+        if char and char in WHITESPACE_ESCAPES:
+            self.pos += 2
+            return char_regex(WHITESPACE_ESCAPES[char])
+        elif char and char in ESCAPABLE_CHARS:
+            self.pos += 2
+            return char_regex(char)
+        numeric_char = self.parse_numeric_escape()
+        if numeric_char is not None:
+            return char_regex(numeric_char)
+        elif char and char in CHARCLASSES:
+            self.pos += 2
+            return CharClass(char)
+        return None
+
+    def parse_numeric_escape(self):  # type: () -> Optional[String]
+        match = ESCAPED_NUMERIC_CHARACTER.match(self.regex, self.pos)
+        if not match:
+            return None
+        self.pos = match.end()
+        octal, hex2, hex4, hex8 = match.groups()
+        if octal:
+            # Octal escape code like '\077'
+            return chr(int(octal, 8))
+        else:
+            # hex escape like '\xff'
+            return chr(int(hex2 or hex4 or hex8, 16))
+
+    def parse_class(self):  # type: () -> Optional[RegularExpression]
+        start = self.pos
+        self.pos += 1
+        negated = self.consume('^')
+        items = []
+        item = self.parse_set_item()
+        while item is not None:
+            items.append(item)
+            item = self.parse_set_item()
+        if not items or not self.consume(']'):
+            self.pos = start
+            return None
+        if not negated:
+            # Union merges all the charsets in one pass, rather than building a
+            # new CharSet for every item in the set.
+            return Union(*items)
+        # A negated set matches the chars which no item matches. So a negated
+        # item like \D restricts it to the chars that item excludes, ie the
+        # intersection of the complements of the items.
+        excluded = frozenset().union(*(item.chars for item in items if not item.negated))
+        required = [item.chars for item in items if item.negated]
+        if not required:
+            return CharSet(excluded, negated=True)
+        chars = frozenset.intersection(*required) - excluded
+        return CharSet(chars) if chars else EMPTY
+
+    def parse_set_item(self):  # type: () -> Optional[RegularExpression]
+        start = self.pos
+        low = self.parse_set_char()
+        if low is not None and self.consume('-'):
+            high = self.parse_set_char()
+            if high is not None:
+                return CharSet([chr(i) for i in range(ord(low), ord(high) + 1)])
+        self.pos = start
+
+        if self.peek() == '\\':
+            char = self.peek(1)
+            if char and char in CHARCLASSES:
+                self.pos += 2
+                return CharClass(char)
+            numeric_char = self.parse_numeric_escape()
+            if numeric_char is not None:
+                return char_regex(numeric_char)
+            elif char and char in WHITESPACE_ESCAPES:
+                self.pos += 2
+                return char_regex(WHITESPACE_ESCAPES[char])
+            elif char and char in CHARSET_ESCAPABLE_CHARS:
+                self.pos += 2
+                return char_regex(char)
+
+        char = self.peek()
+        if not char or char == ']':
+            return None
+        self.pos += 1
+        return char_regex(char)
+
+    def parse_set_char(self):  # type: () -> Optional[String]
+        numeric_char = self.parse_numeric_escape()
+        if numeric_char is not None:
+            return numeric_char
+        char = self.peek()
+        if char == '\\' and self.peek(1) and self.peek(1) in CHARSET_ESCAPABLE_CHARS:
+            self.pos += 2
+            return self.regex[self.pos - 1]
+        elif not char or char == ']':
+            return None
+        self.pos += 1
+        return char
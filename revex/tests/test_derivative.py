@@ -1,8 +1,8 @@
 import re
 
+from revex import compile
 from revex.derivative import (
-    EMPTY, EPSILON, Concatenation, Intersection, Union, Complement, Star, RegexVisitor,
-    CharSet)
+    EMPTY, EPSILON, Concatenation, Intersection, Union, Complement, Star, CharSet, WHATEVER)
 
 
 a, b, c = [CharSet(char) for char in 'abc']
@@ -20,10 +20,6 @@ TYPE_TO_EXAMPLE = {
 }
 
 
-def compile(regex):
-    return RegexVisitor().parse(regex)
-
-
 def test_type_setup():
     for k, v in TYPE_TO_EXAMPLE.items():
         assert type(v) is k
@@ -49,6 +45,7 @@ def test_matching():
     assert (Star(a) & Star(a + a | b)).match('aa')
     assert not (Star(a) & Star(a + a | b)).match('aaa')
     assert (Star(a) & Star(a + a | b)).match('aaaa')
+    assert not (a + b).match('c' * 10)
 
 
 def test_equality_and_construction():
@@ -92,15 +89,38 @@ def test_equality_and_construction():
     assert compile(r'[^ab]') & compile(r'[b]') == EMPTY
     assert compile(r'[^ab]') & compile(r'[^bc]') == compile('[^abc]')
 
+    assert Star(a) & ~Star(a) is EMPTY
+    assert (b + c) & Star(a) & ~Star(a) is EMPTY
+    assert Star(a) | ~Star(a) is WHATEVER
+    assert (b + c) | Star(a) | ~Star(a) is WHATEVER
+    assert Union(EMPTY, Star(a), ~Star(a)) is WHATEVER
+    assert Union(EMPTY, b + c, Star(a), ~Star(a)) is WHATEVER
+
 
 def test_concatenation_is_associative():
     assert (a + b) + c == a + (b + c)
 
 
+def test_repeat():
+    assert a * 0 is EPSILON
+    assert a * 1 is a
+    for n in range(2, 12):
+        assert (a + b) * n is Concatenation(*([a, b] * n))
+
+
 def test_union_is_associative():
     assert (Star(a) | Star(b)) | c == Star(a) | (Star(b) | c)
 
 
+def test_union_factors_common_prefixes():
+    assert compile('ab|ac|ad|e') is a + CharSet('bcd') | CharSet('e')
+    assert compile('abc|abd|ac|b') is a + (b + CharSet('cd') | c) | b
+    assert compile('ab|ac') is a + CharSet('bc')
+    # The factored form doesn't depend on how the alternatives are grouped.
+    assert compile('ab|ac|ad|ae|af') is compile('(ab|ac|ad|ae)|af') is a + CharSet('bcdef')
+    assert compile('(abc|ab)|(ad|b)') is compile('abc|(ab|ad)|b') is compile('b|ad|ab|abc')
+
+
 def test_intersection_is_associative():
     assert (
         (Star(a | b | c) & Star(b | c)) & Star(a | b) ==
@@ -124,6 +144,17 @@ def test_str_repr():
     assert str(compile('..')) == '..'
     assert repr(compile('..')) == 'DOT+DOT'
 
+    # Union and intersection strings don't depend on which children happened
+    # to be constructed first.
+    assert str(b + c | a) == '(bc)|a'
+    assert repr(b + c | a) == '(CharSet((\'b\',), negated=False)+CharSet((\'c\',), negated=False))|CharSet((\'a\',), negated=False)'
+    assert str(Star(c) & Star(a)) == 'a*∩c*'
+
+    # Strings of composite regexes are cached.
+    regex = compile('(ab|c)*d')
+    assert str(regex) is str(regex)
+    assert repr(regex) is repr(regex)
+
 
 def test_parser():
     assert compile('ab|c') == (a + b) | c
@@ -156,3 +187,74 @@ def test_complex_regex():
         assert 1 == len({bool(actual.match(example)),
                          regex.match(example),
                          dfa.match(example)})
+
+
+def test_derivative_is_memoized():
+    regex = Star(a | b) + c
+    derivative = regex.derivative('a')
+    assert derivative == Star(a | b) + c
+    assert regex.derivative('a') is derivative
+    assert regex._derivatives == {'a': derivative}
+    assert CharSet('ab', negated=True)._derivatives == {'a': EMPTY, 'b': EMPTY}
+
+
+def test_long_concatenation_derivative():
+    # The derivative of each a? depends on the derivative of the rest, which
+    # shouldn't be computed recursively.
+    regex = compile('a?' * 600 + 'b')
+    assert regex.derivative('a').derivative('b').accepting
+    assert regex.match('a' * 10 + 'b')
+    # Building a DFA needs each state's distinguished sets, which also
+    # shouldn't be computed recursively.
+    dfa = compile('a{0,400}b').as_dfa(alphabet='ab')
+    assert dfa.match('a' * 400 + 'b')
+    assert not dfa.match('a' * 401 + 'b')
+
+
+def test_first_chars():
+    assert compile('a?b|c').first_chars == frozenset('abc')
+    assert compile('ab*').first_chars == frozenset('a')
+    assert compile('[^a]b').first_chars is None
+    assert (~a).first_chars is None
+    assert (Star(a | b) & (b + c)).first_chars == frozenset('b')
+    assert (Star(a) & ~b).first_chars == frozenset('a')
+    assert EPSILON.first_chars == EMPTY.first_chars == frozenset()
+    assert compile('(ab)*c').derivative('d') is EMPTY
+
+
+def test_required_literal():
+    assert compile('.*foo(bar|baz)').required_literal == 'fooba'
+    assert compile('.*foo(bar|qux)').required_literal == 'foo'
+    assert compile('ab|cab').required_literal == 'ab'
+    assert compile('ab|ba').required_literal == ''
+    assert compile('x(?=.*abc).*').required_literal == 'abc'
+    assert compile('[ab]cd*').required_literal == 'c'
+    assert not compile('.*foo.*').match('fo' * 50)
+    assert compile('.*foo.*').match('fo' * 50 + 'o')
+
+
+def test_derivative_partition():
+    assert Star(a | b).derivative_partition('abcd') == [['a', 'b'], ['c', 'd']]
+    assert WHATEVER.derivative_partition('abcd') == [['a', 'b', 'c', 'd']]
+    regex = compile('[ab]c|a|.*d')
+    assert regex.derivative_partition('abcde') == [['a'], ['b'], ['c', 'e'], ['d']]
+    for chars in regex.derivative_partition('abcde'):
+        assert len({regex.derivative(char) for char in chars}) == 1
+
+
+def test_regexes_are_interned():
+    assert compile('a|b') is compile('b|a')
+    assert (a + b) is (a + b)
+    assert Star(a | b) is Star(b | a)
+    assert ~Star(a) is ~Star(a)
+    assert ~~Star(a) is Star(a)
+    assert CharSet('ba') is CharSet('ab')
+    assert CharSet('ab') is not CharSet('ab', negated=True)
+    assert compile(r'\d') is not CharSet('0123456789')
+    assert (Star(a) | Star(a)) is Star(a)
+    assert (Star(a) & Star(a)) is Star(a)
+
+
+def test_regexes_have_no_dict():
+    for regex in [EMPTY, EPSILON, compile(r'\d'), ~a] + list(TYPE_TO_EXAMPLE.values()):
+        assert not hasattr(regex, '__dict__')
@@ -4,6 +4,7 @@ import re
 from typing import Set  # noqa
 from typing import Tuple  # noqa
 
+import numpy as np
 import pytest
 import six  # noqa
 from hypothesis import given, example
@@ -12,7 +13,7 @@ from hypothesis import strategies as st
 import revex
 from revex.derivative import EPSILON, EMPTY
 from revex.dfa import DFA, get_equivalent_states, minimize_dfa, \
-    InfiniteLanguageError, EmptyLanguageError
+    InfiniteLanguageError, EmptyLanguageError, _collapse_ranges, _run_table
 
 
 example_regex = revex.compile(r'a[abc]*b[abc]*c')
@@ -32,6 +33,68 @@ def test_dfa_matches_builtin(s):
     assert example_dfa.match(s) == bool(example_builtin_regex.match(s))
 
 
+def test_match_after_adding_transitions():
+    dfa = DFA(0, False, alphabet='a')  # type: DFA[int]
+    dfa.add_state(1, True)
+    dfa.add_transition(0, 1, 'a')
+    assert dfa.match('a')
+    assert not dfa.match('')
+    with pytest.raises(KeyError):
+        dfa.match('aa')
+    dfa.add_transition(1, 1, 'a')
+    assert dfa.match('aa')
+
+
+def test_readding_state_updates_accepting():
+    dfa = DFA(0, False, alphabet='a')  # type: DFA[int]
+    dfa.add_state(1, True)
+    dfa.add_transition(0, 1, 'a')
+    assert dfa.match('a')
+    assert not dfa.is_empty
+    dfa.add_state(1, False)
+    assert not dfa.match('a')
+    assert dfa.is_empty
+
+
+def test_acceptable_subgraph_is_cached():
+    dfa = DFA(0, False, alphabet='a')  # type: DFA[int]
+    dfa.add_state(1, True)
+    assert dfa.is_empty
+    assert dfa._acceptable_subgraph is dfa._acceptable_subgraph
+    dfa.add_transition(0, 1, 'a')
+    assert not dfa.is_empty
+    assert dfa.longest_string == 'a'
+
+
+def test_add_transitions():
+    dfa = DFA(0, False, alphabet='abc')  # type: DFA[int]
+    dfa.add_state(1, True)
+    dfa.add_transitions(0, 1, 'ab')
+    dfa.add_transitions(0, 1, 'ab')
+    assert dfa.delta[0] == {'a': 1, 'b': 1}
+    # Transitions between the same states share an edge.
+    assert dfa.edges(data='transition') == [(0, 1, frozenset('ab'))]
+    with pytest.raises(ValueError):
+        dfa.add_transitions(0, 0, 'ca')
+    with pytest.raises(ValueError):
+        dfa.add_transitions(0, 2, 'c')
+
+
+def test_collapse_ranges():
+    assert _collapse_ranges('') == ''
+    assert _collapse_ranges('xy0abcde') == '0a-exy'
+    assert _collapse_ranges('ace') == 'ace'
+
+
+def test_run_table():
+    # Transitions 0 -a-> 1 -a-> 1.
+    table = np.full((2, 128), -1, dtype=np.int32)
+    table[0, ord('a')] = table[1, ord('a')] = 1
+    assert _run_table(table, np.frombuffer(b'aaa', dtype=np.uint8), 0) == 1
+    assert _run_table(table, np.frombuffer(b'', dtype=np.uint8), 0) == 0
+    assert _run_table(table, np.frombuffer(b'aab', dtype=np.uint8), 0) == -3
+
+
 def test_equivalent_state_computation():
     # Construct a DFA where all states are equivalent to each other.
     alphabet = '01'
@@ -117,6 +180,20 @@ def test_equivalent_state_example():
     assert expected_dfa.construct_isomorphism(new_dfa)
 
 
+def test_minimize_merges_transitively_equivalent_states():
+    # Counting a's mod 6, accepting an even count. Only the parity matters.
+    dfa = DFA(0, True, alphabet='ab')  # type: DFA[int]
+    for state in range(1, 6):
+        dfa.add_state(state, state % 2 == 0)
+    for state in range(6):
+        dfa.add_transition(state, (state + 1) % 6, 'a')
+        dfa.add_transition(state, state, 'b')
+    new_dfa = minimize_dfa(dfa)
+    assert set(new_dfa.node) == {frozenset([0, 2, 4]), frozenset([1, 3, 5])}
+    assert new_dfa.match('aabaab')
+    assert not new_dfa.match('ababa')
+
+
 def test_has_finite_language():
     assert revex.build_dfa('aa').has_finite_language
     assert not revex.build_dfa('aa*').has_finite_language
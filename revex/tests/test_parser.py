@@ -9,8 +9,9 @@ import pytest
 from hypothesis import strategies as st
 
 from revex import compile
-from revex.derivative import REGEX, EPSILON
-from revex.regex_grammar import ESCAPABLE_CHARS, CHARSET_ESCAPABLE_CHARS
+from revex.derivative import EPSILON
+from revex.regex_grammar import (
+    ESCAPABLE_CHARS, CHARSET_ESCAPABLE_CHARS, RegexSyntaxError, char_regex)
 
 
 class RE(object):
@@ -23,6 +24,18 @@ class RE(object):
         return self.re.match(string)
 
 
+def test_compile_is_cached():
+    compile.cache_clear()
+    compile('ab*')
+    assert compile('ab*') is compile('ab*')
+    assert compile.cache_info().hits == 2
+
+
+def test_char_regexes_are_reused():
+    assert char_regex('a') is char_regex('a') is compile('a')
+    assert compile(r'[\n]') is compile(r'\n') is char_regex('\n')
+
+
 def test_empty():
     assert compile('') == EPSILON
     assert RE('(a|)').match('')
@@ -37,6 +50,9 @@ def test_string_literal_regex():
     assert not regex.match('abcd')
     assert not regex.match('ab')
 
+    long_literal = 'hello world ' * 500
+    assert compile(long_literal).required_literal == long_literal
+
 
 def test_star():
     regex = RE('a*')
@@ -134,6 +150,24 @@ def test_inverted_range_and_charset():
     assert m.match('^')
 
 
+def test_inverted_charset_with_negated_charclass():
+    m = RE(r'[^a\D]')
+    for c in '0123456789':
+        assert m.match(c)
+    for c in 'abz -':
+        assert not m.match(c)
+
+    m = RE(r'[^\W\d_]')
+    for c in 'aZq':
+        assert m.match(c)
+    for c in '07_ -':
+        assert not m.match(c)
+
+    m = RE(r'[^\d\D]')
+    for c in 'a0 ':
+        assert not m.match(c)
+
+
 def test_open_ended_range():
     m = RE('a{,5}')
     for i in range(6):
@@ -146,6 +180,19 @@ def test_open_ended_range():
         assert m2.match('a' * i)
 
 
+@pytest.mark.parametrize('regex', ['(a', 'a)', '*', 'a**', '(?=a', '(?#a', 'a|+'])
+def test_syntax_error(regex):
+    with pytest.raises(RegexSyntaxError):
+        compile(regex)
+
+
+def test_unparseable_sets_and_escapes_are_literals():
+    # These are errors in python's re module, but are parsed literally here.
+    assert compile('[a').match('[a')
+    assert compile('[]').match('[]')
+    assert compile('a\\').match('a\\')
+
+
 def test_repeat():
     regex = RE('a{0,2}[a-z]')
     assert regex.match('q')
@@ -153,6 +200,10 @@ def test_repeat():
     assert regex.match('a' * 2 + 'q')
     assert not regex.match('a' * 3 + 'q')
 
+    regex = RE('(ab){2,4}')
+    for i in range(6):
+        assert regex.match('ab' * i) == (2 <= i <= 4)
+
     assert compile('a{3}') == compile('aaa')
 
     assert compile('ba{3}') == compile('baaa')
@@ -194,12 +245,12 @@ def test_noncapturing_group():
 
 
 def test_lookaround_grammar():
-    assert REGEX.parse(r'foo(?=bar).*')
-    assert REGEX.parse(r'foo(?=bar)')
-    assert REGEX.parse(r'foo(?=(ab)*)')
-    assert REGEX.parse(r'foo(?!bar)')
-    assert REGEX.parse(r'.*(?<=bar)foo')
-    assert REGEX.parse(r'.*(?<!bar)foo')
+    assert compile(r'foo(?=bar).*')
+    assert compile(r'foo(?=bar)')
+    assert compile(r'foo(?=(ab)*)')
+    assert compile(r'foo(?!bar)')
+    assert compile(r'.*(?<=bar)foo')
+    assert compile(r'.*(?<!bar)foo')
     RE(r'foo(?=bar).*')
 
 
@@ -286,7 +337,7 @@ def test_url_validation_example():
     # URL validation regex from https://mathiasbynens.be/demo/url-regex
     # (@diegoperini)
     regex = r'(?:(?:https?|ftp)://)(?:\S+(?::\S*)?@)?(?:(?!10(?:\.\d{1,3}){3})(?!127(?:\.\d{1,3}){3})(?!169\.254(?:\.\d{1,3}){2})(?!192\.168(?:\.\d{1,3}){2})(?!172\.(?:1[6-9]|2\d|3[0-1])(?:\.\d{1,3}){2})(?:[1-9]\d?|1\d\d|2[01]\d|22[0-3])(?:\.(?:1?\d{1,2}|2[0-4]\d|25[0-5])){2}(?:\.(?:[1-9]\d?|1\d\d|2[0-4]\d|25[0-4]))|(?:(?:[a-z\u00a1-\uffff0-9]+-?)*[a-z\u00a1-\uffff0-9]+)(?:\.(?:[a-z\u00a1-\uffff0-9]+-?)*[a-z\u00a1-\uffff0-9]+)*(?:\.(?:[a-z\u00a1-\uffff]{2,})))(?::\d{2,5})?(?:/[^\s]*)?'  # noqa
-    assert REGEX.parse(regex)
+    assert compile(regex)
     assert RE(regex).match('http://foo.com/bar')
 
 
@@ -337,5 +388,5 @@ def test_special_charset_chars_unicode():
 def test_hard_character_range_example(char):
     # Via https://twitter.com/mountain_ghosts/status/847130837644709888
     regex = r'[ -\/:-@\[-`\{-~]'
-    assert REGEX.parse(regex)
+    assert compile(regex)
     RE(regex).match(char)  # Asserts the same as builtin re.compile.
@@ -1,9 +1,11 @@
 from setuptools import setup
 import sys
 
-install_requires = ['parsimonious', 'networkx', 'six', 'numpy']
+install_requires = ['networkx', 'six', 'numpy']
 if sys.version_info < (3, 5):
     install_requires.append('typing')
+if sys.version_info < (3, 2):
+    install_requires.append('backports.functools_lru_cache')
 
 setup(name='revex',
       version='0.0.0',
@@ -14,5 +16,6 @@ setup(name='revex',
       license='Apache 2.0',
       packages=['revex'],
       install_requires=install_requires,
+      extras_require={'numba': ['numba']},
       long_description='foo',
       zip_safe=False)